@@ -5,19 +5,213 @@ LangGraph 简洁版工具集成智能体
 支持自定义工具和 LangChain 内置工具。
 """
 
+import asyncio
 import os
+import sqlite3
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+import httpx
 from dotenv import load_dotenv
+from typing_extensions import NotRequired
+from langchain_core.messages import (
+    AIMessageChunk, HumanMessage, RemoveMessage, SystemMessage, get_buffer_string
+)
+from langchain_core.runnables import RunnableLambda
 from langchain_deepseek import ChatDeepSeek
+from langgraph.graph.message import REMOVE_ALL_MESSAGES
 from langgraph.prebuilt import create_react_agent
-from langgraph.checkpoint.memory import MemorySaver
+from langgraph.prebuilt.chat_agent_executor import AgentState
+from langgraph.checkpoint.sqlite import SqliteSaver
 
 # 导入我们的工具
-from tools import AVAILABLE_TOOLS
-from langchain_tools import get_available_tools
+from tools import AVAILABLE_TOOLS, LoopLocalTransport
+from langchain_tools import ALL_TOOLS
 
 # 加载环境变量
 load_dotenv()
 
+# 共享的大模型客户端（惰性创建，全进程复用同一个连接池）
+_LLM = None
+
+def _get_llm():
+    """
+    获取共享的 ChatDeepSeek 实例，避免每次创建智能体都重建 HTTP 客户端和 TLS 连接
+    
+    异步客户端的连接池按事件循环隔离（LoopLocalTransport），
+    多次 asyncio.run 调用 achat/achat_stream 时不会复用已关闭循环上的连接。
+    """
+    global _LLM
+    if _LLM is None:
+        limits = httpx.Limits(max_keepalive_connections=20)
+        _LLM = ChatDeepSeek(
+            api_key=os.getenv("DEEPSEEK_API_KEY"),
+            model=os.getenv("MODEL_NAME", "deepseek-chat"),
+            temperature=float(os.getenv("TEMPERATURE", "0.7")),
+            max_tokens=int(os.getenv("MAX_TOKENS", "2000")),
+            http_client=httpx.Client(http2=True, limits=limits),
+            http_async_client=httpx.AsyncClient(transport=LoopLocalTransport(http2=True, limits=limits))
+        )
+    return _LLM
+
+async def awarmup():
+    """预热大模型连接：发送一个 1 token 的请求，提前完成异步 HTTP 客户端的 DNS 解析和 TLS 握手"""
+    try:
+        await _get_llm().bind(max_tokens=1).ainvoke("ping")
+    except Exception as e:
+        print(f"⚠️ 模型预热失败: {e}")
+
+# 对话摘要：消息数超过阈值时，把较早的消息压缩成一条摘要，只保留最近的消息原文
+SUMMARY_THRESHOLD = 20
+SUMMARY_KEEP_MESSAGES = 10
+SUMMARY_PROMPT = "请用简洁的中文总结以下对话的要点，保留用户的关键信息、偏好和未完成的任务。"
+
+# 每个会话在内存中缓存的最大消息数
+HISTORY_MAXLEN = 200
+
+class SummaryState(AgentState):
+    """在默认智能体状态上增加对话摘要字段"""
+    summary: NotRequired[str]
+
+def _summary_cut(messages) -> int:
+    """返回需要被摘要的消息数，0 表示暂不需要摘要"""
+    # 开头的上一次摘要消息不计入阈值
+    start = 1 if messages and isinstance(messages[0], SystemMessage) else 0
+    if len(messages) - start <= SUMMARY_THRESHOLD:
+        return 0
+    
+    # 从用户消息处切分，避免把工具调用和对应的工具结果拆开
+    cut = len(messages) - SUMMARY_KEEP_MESSAGES
+    while cut > start and not isinstance(messages[cut], HumanMessage):
+        cut -= 1
+    
+    # 切分点之前只有上一次的摘要时无需重新摘要，否则单轮工具循环较长时每一步都会重复总结
+    return cut if cut > start else 0
+
+def _summary_input(messages):
+    """构造摘要请求（之前的摘要消息也在其中，会被一起纳入新的摘要）"""
+    return [
+        SystemMessage(content=SUMMARY_PROMPT),
+        HumanMessage(content=get_buffer_string(messages))
+    ]
+
+def _summary_update(messages, cut: int, summary: str):
+    """用一条摘要消息替换前 cut 条消息"""
+    return {
+        "summary": summary,
+        "messages": [
+            RemoveMessage(id=REMOVE_ALL_MESSAGES),
+            SystemMessage(content=f"此前对话摘要: {summary}"),
+            *messages[cut:]
+        ]
+    }
+
+def summarize_messages(state: SummaryState):
+    """
+    模型调用前的摘要节点（pre_model_hook）
+    
+    消息数超过 SUMMARY_THRESHOLD 时，把较早的消息交给模型总结，
+    并用一条摘要消息替换它们，使每轮输入的 token 数保持有界。
+    """
+    messages = state["messages"]
+    cut = _summary_cut(messages)
+    if not cut:
+        return {}
+    
+    response = _get_llm().invoke(_summary_input(messages[:cut]))
+    return _summary_update(messages, cut, response.content)
+
+async def asummarize_messages(state: SummaryState):
+    """summarize_messages 的异步版本，在 ainvoke/astream 中不会阻塞事件循环"""
+    messages = state["messages"]
+    cut = _summary_cut(messages)
+    if not cut:
+        return {}
+    
+    response = await _get_llm().ainvoke(_summary_input(messages[:cut]))
+    return _summary_update(messages, cut, response.content)
+
+# 同时提供同步和异步实现，图在 invoke 和 ainvoke 下都会调用对应的版本
+SUMMARY_HOOK = RunnableLambda(summarize_messages, afunc=asummarize_messages)
+
+def _make_config(thread_id: str, user_context: Optional[str] = None):
+    """
+    构造一轮对话的运行配置，动态上下文通过 configurable 传给 inject_user_context
+    
+    metadata 中的 turn_id 会写入本轮检查点的元数据，用于在结束后找到本轮自己写入的检查点。
+    """
+    configurable = {"thread_id": thread_id}
+    if user_context:
+        configurable["user_context"] = user_context
+    return {"configurable": configurable, "metadata": {"turn_id": uuid.uuid4().hex}}
+
+def inject_user_context(state: SummaryState, config):
+    """
+    模型输入构造（create_react_agent 的 prompt）
+    
+    把本轮的动态上下文（configurable.user_context）插在最新一条用户消息之前。
+    上下文只出现在发给模型的输入中，不写入会话状态，因此不会在历史里逐轮累积；
+    放在历史之后也保证了工具定义和已有历史组成的前缀不变，便于命中前缀缓存。
+    """
+    messages = state["messages"]
+    user_context = config.get("configurable", {}).get("user_context")
+    if not user_context:
+        return messages
+    
+    for i in range(len(messages) - 1, -1, -1):
+        if isinstance(messages[i], HumanMessage):
+            context_message = HumanMessage(content=f"[用户上下文]\n{user_context}")
+            return [*messages[:i], context_message, *messages[i:]]
+    return messages
+
+class _ThreadedSqliteSaver(SqliteSaver):
+    """SqliteSaver 只实现了同步接口，这里把异步接口转到线程中执行，使 ainvoke 也能使用同一个数据库"""
+    
+    async def aget_tuple(self, config):
+        return await asyncio.to_thread(self.get_tuple, config)
+    
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        items = await asyncio.to_thread(
+            lambda: list(self.list(config, filter=filter, before=before, limit=limit))
+        )
+        for item in items:
+            yield item
+    
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+    
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        return await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+    
+    async def adelete_thread(self, thread_id):
+        return await asyncio.to_thread(self.delete_thread, thread_id)
+    
+    def latest_checkpoint_id(self, thread_id: str) -> Optional[str]:
+        """查询会话最新检查点的 ID（只走主键索引，不反序列化检查点）"""
+        with self.cursor(transaction=False) as cur:
+            cur.execute(
+                "SELECT checkpoint_id FROM checkpoints "
+                "WHERE thread_id = ? AND checkpoint_ns = '' "
+                "ORDER BY checkpoint_id DESC LIMIT 1",
+                (thread_id,)
+            )
+            row = cur.fetchone()
+        return row[0] if row else None
+    
+    def turn_checkpoint_id(self, config) -> Optional[str]:
+        """查询本轮运行（config 中的 turn_id）最后写入的检查点 ID，不受其他写入者影响"""
+        with self.cursor(transaction=False) as cur:
+            cur.execute(
+                "SELECT checkpoint_id FROM checkpoints "
+                "WHERE thread_id = ? AND checkpoint_ns = '' "
+                "AND json_extract(CAST(metadata AS TEXT), '$.turn_id') = ? "
+                "ORDER BY checkpoint_id DESC LIMIT 1",
+                (config["configurable"]["thread_id"], config["metadata"]["turn_id"])
+            )
+            row = cur.fetchone()
+        return row[0] if row else None
+
 class SimpleToolAgent:
     """简洁版工具集成智能体"""
     
@@ -28,59 +222,181 @@ class SimpleToolAgent:
         Args:
             use_langchain_tools: 是否使用 LangChain 内置工具
         """
-        # 初始化大模型
-        self.model = ChatDeepSeek(
-            api_key=os.getenv("DEEPSEEK_API_KEY"),
-            model=os.getenv("MODEL_NAME", "deepseek-chat"),
-            temperature=float(os.getenv("TEMPERATURE", "0.7")),
-            max_tokens=int(os.getenv("MAX_TOKENS", "2000"))
-        )
+        # 获取共享的大模型实例
+        self.model = _get_llm()
         
-        # 创建内存检查点
-        self.memory = MemorySaver()
+        # 检查点和图都在第一次使用时才创建（见 agent 属性）
+        self.memory = None
+        self._agent = None
         
-        # 组合工具列表
-        all_tools = AVAILABLE_TOOLS.copy()
+        # 按 thread_id 缓存最近一轮结束时的 (检查点ID, 消息)，读取历史时无需反序列化检查点
+        self._history_index: dict[str, tuple[Optional[str], deque]] = {}
         
+        # 工具列表（ALL_TOOLS 在导入时已组合好）
         if use_langchain_tools:
-            try:
-                langchain_tools = get_available_tools()
-                all_tools.extend(langchain_tools)
-                print(f"✅ 已加载 {len(langchain_tools)} 个 LangChain 内置工具")
-            except Exception as e:
-                print(f"⚠️ LangChain 工具加载失败: {e}")
+            self.tools = ALL_TOOLS
+            print(f"✅ 已加载 {len(ALL_TOOLS) - len(AVAILABLE_TOOLS)} 个 LangChain 内置工具")
+        else:
+            self.tools = AVAILABLE_TOOLS
+    
+    @property
+    def agent(self):
+        """编译后的智能体图，第一次访问时才创建检查点并编译"""
+        if self._agent is None:
+            # 创建 SQLite 检查点（按 thread_id 建索引，历史越长优势越明显）
+            conn = sqlite3.connect(os.getenv("CHECKPOINT_DB", "checkpoints.db"), check_same_thread=False)
+            self.memory = _ThreadedSqliteSaver(conn)
+            
+            # 使用 create_react_agent 创建智能体 - 就这么简单！
+            self._agent = create_react_agent(
+                model=self.model,
+                tools=self.tools,
+                prompt=inject_user_context,
+                pre_model_hook=SUMMARY_HOOK,
+                state_schema=SummaryState,
+                checkpointer=self.memory
+            )
+        return self._agent
+    
+    def chat(self, message: str, thread_id: str = "default", user_context: Optional[str] = None):
+        """
+        与智能体对话
         
-        self.tools = all_tools
+        Args:
+            message: 用户消息
+            thread_id: 会话ID
+            user_context: 可选的动态上下文（如用户资料），只在本轮发给模型，不写入对话历史
+        """
+        config = _make_config(thread_id, user_context)
         
-        # 使用 create_react_agent 创建智能体 - 就这么简单！
-        self.agent = create_react_agent(
-            model=self.model,
-            tools=self.tools,
-            checkpointer=self.memory
+        # 直接调用智能体（checkpoint_during=False：本轮结束时只写一次检查点，而不是每个节点都写）
+        result = self.agent.invoke(
+            {"messages": [("user", message)]},
+            config=config,
+            checkpoint_during=False
         )
-    
-    def chat(self, message: str, thread_id: str = "default"):
-        """与智能体对话"""
-        config = {"configurable": {"thread_id": thread_id}}
+        self._remember(thread_id, result["messages"], self.memory.turn_checkpoint_id(config))
         
-        # 直接调用智能体
-        result = self.agent.invoke(
+        # 返回最后一条AI消息
+        return result["messages"][-1].content
+
+    async def achat(self, message: str, thread_id: str = "default", user_context: Optional[str] = None):
+        """与智能体对话（异步），同一步中的多个工具调用会并发执行"""
+        config = _make_config(thread_id, user_context)
+        
+        result = await self.agent.ainvoke(
             {"messages": [("user", message)]},
-            config=config
+            config=config,
+            checkpoint_during=False
         )
+        self._remember(thread_id, result["messages"], self.memory.turn_checkpoint_id(config))
         
         # 返回最后一条AI消息
         return result["messages"][-1].content
-    
+
+    def chat_stream(self, message: str, thread_id: str = "default", user_context: Optional[str] = None):
+        """与智能体对话（流式），逐个产出模型生成的文本片段"""
+        config = _make_config(thread_id, user_context)
+        
+        final_state = None
+        for mode, payload in self.agent.stream(
+            {"messages": [("user", message)]},
+            config=config,
+            stream_mode=["messages", "values"],
+            checkpoint_during=False
+        ):
+            if mode == "values":
+                final_state = payload
+                continue
+            
+            # 只输出模型节点生成的文本，跳过工具消息
+            chunk, metadata = payload
+            if metadata.get("langgraph_node") == "agent" and isinstance(chunk, AIMessageChunk) and chunk.content:
+                yield chunk.content
+        
+        if final_state is not None:
+            self._remember(thread_id, final_state["messages"], self.memory.turn_checkpoint_id(config))
+
+    async def achat_stream(self, message: str, thread_id: str = "default", user_context: Optional[str] = None):
+        """chat_stream 的异步版本"""
+        config = _make_config(thread_id, user_context)
+        
+        final_state = None
+        async for mode, payload in self.agent.astream(
+            {"messages": [("user", message)]},
+            config=config,
+            stream_mode=["messages", "values"],
+            checkpoint_during=False
+        ):
+            if mode == "values":
+                final_state = payload
+                continue
+            
+            # 只输出模型节点生成的文本，跳过工具消息
+            chunk, metadata = payload
+            if metadata.get("langgraph_node") == "agent" and isinstance(chunk, AIMessageChunk) and chunk.content:
+                yield chunk.content
+        
+        if final_state is not None:
+            self._remember(thread_id, final_state["messages"], self.memory.turn_checkpoint_id(config))
+
+    def chat_many(self, messages: list[tuple[str, str]], max_concurrency: int = 4):
+        """
+        批量对话，不同会话并发发送请求
+
+        Args:
+            messages: (消息, thread_id) 元组列表；同一 thread_id 的消息按顺序依次发送
+            max_concurrency: 最多同时进行的会话数
+
+        Returns:
+            与输入顺序一致的回复列表
+        """
+        # 按会话分组：同一会话共享一个检查点，必须串行执行，否则后一轮会覆盖前一轮
+        groups: dict[str, list[tuple[int, str]]] = {}
+        for index, (message, thread_id) in enumerate(messages):
+            groups.setdefault(thread_id, []).append((index, message))
+
+        replies = [None] * len(messages)
+
+        def run_thread(thread_id: str, items: list[tuple[int, str]]):
+            for index, message in items:
+                replies[index] = self.chat(message, thread_id)
+
+        # 并发上限只作用于会话级线程池，不写入图配置，避免限制单轮内工具调用的并发
+        self.agent  # 在主线程中完成图的惰性编译
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            futures = [executor.submit(run_thread, thread_id, items) for thread_id, items in groups.items()]
+            for future in futures:
+                future.result()
+
+        return replies
+
+    def _remember(self, thread_id: str, messages, checkpoint_id: Optional[str]):
+        """记录会话的消息及其所属检查点的 ID，返回缓存的消息"""
+        history = deque(messages, maxlen=HISTORY_MAXLEN)
+        self._history_index[thread_id] = (checkpoint_id, history)
+        return history
+
     def get_conversation_history(self, thread_id: str = "default"):
-        """获取对话历史"""
-        config = {"configurable": {"thread_id": thread_id}}
+        """
+        获取对话历史
+        
+        优先返回内存缓存；检查点数据库可能被其他智能体或进程写入，
+        因此先比对最新检查点 ID，不一致时再从检查点重新加载。
+        """
+        self.agent  # 确保检查点已创建
+        cached = self._history_index.get(thread_id)
+        if cached is not None and cached[0] == self.memory.latest_checkpoint_id(thread_id):
+            return list(cached[1])
         
-        # 获取当前状态
+        # 缓存未命中或已过期，从检查点加载
+        config = {"configurable": {"thread_id": thread_id}}
         current_state = self.agent.get_state(config)
         
         if current_state and current_state.values:
-            return current_state.values.get("messages", [])
+            messages = current_state.values.get("messages", [])
+            history = self._remember(thread_id, messages, current_state.config["configurable"]["checkpoint_id"])
+            return list(history)
         return []
     
     def list_tools(self):
@@ -114,6 +430,10 @@ class SimpleToolAgent:
 
 def main():
     """主函数 - 演示简洁版智能体的使用"""
+    asyncio.run(_amain())
+
+async def _amain():
+    """异步对话循环：输入在线程中读取，模型调用走异步接口，不阻塞事件循环"""
     print("🤖 LangGraph 简洁版工具智能体启动中...")
     print("💡 提示：输入 'quit' 或 'exit' 退出程序")
     print("=" * 70)
@@ -121,6 +441,7 @@ def main():
     try:
         # 创建智能体 - 支持 LangChain 内置工具
         agent = SimpleToolAgent(use_langchain_tools=True)
+        await awarmup()
         print("✅ 智能体初始化成功！")
         
         # 显示可用工具
@@ -139,7 +460,7 @@ def main():
         
         # 对话循环
         while True:
-            user_input = input("\n👤 你: ").strip()
+            user_input = (await asyncio.to_thread(input, "\n👤 你: ")).strip()
             
             if user_input.lower() in ['quit', 'exit', '退出', 'q']:
                 print("👋 再见！")
@@ -149,10 +470,11 @@ def main():
                 continue
             
             try:
-                # 获取回复
-                print("🤔 思考中...")
-                response = agent.chat(user_input)
-                print(f"🤖 助手: {response}")
+                # 流式输出回复
+                print("🤖 助手: ", end="", flush=True)
+                async for token in agent.achat_stream(user_input):
+                    print(token, end="", flush=True)
+                print()
                 
             except Exception as e:
                 print(f"❌ 出错了: {e}")
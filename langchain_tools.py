@@ -4,19 +4,17 @@ LangChain 内置工具集合
 """
 
 import os
-from pydantic import BaseModel, Field
+from dotenv import load_dotenv
+from langchain_core.tools import StructuredTool
+
+from tools import AVAILABLE_TOOLS, SearchInput, _HAS_SERPAPI, _get_search
 
 
 # ================================
 # SerpAPI 网络搜索工具
 # ================================
 
-class SearchInput(BaseModel):
-    """搜索输入参数"""
-    query: str = Field(description="搜索关键词或问题")
-    num_results: int = Field(default=5, description="返回结果数量，默认5个")
-
-def serpapi_search(query: str, num_results: int = 5) -> str:
+def _serpapi_search(query: str, num_results: int = 5) -> str:
     """
     使用 SerpAPI 搜索互联网信息
     
@@ -28,40 +26,41 @@ def serpapi_search(query: str, num_results: int = 5) -> str:
         搜索结果摘要
     """
     try:
-        # 检查API密钥
-        api_key = os.getenv("SERPAPI_API_KEY")
-        if not api_key:
-            return "❌ 错误: 请设置 SERPAPI_API_KEY 环境变量"
-        
-        # 使用 LangChain 的 SerpAPIWrapper
-        from langchain_community.utilities import SerpAPIWrapper
-        
-        # 创建搜索包装器
-        search = SerpAPIWrapper(
-            serpapi_api_key=api_key,
-            params={
-                "engine": "google",
-                "google_domain": "google.com.hk",
-                "gl": "cn",
-                "hl": "zh-cn",
-                "num": num_results
-            }
-        )
+        search, error = _get_search(num_results)
+        if error:
+            return error
         
         # 执行搜索
         result = search.run(query)
         
         return f"🔍 搜索关键词: {query}\n\n📊 搜索结果:\n{result}"
             
-    except ImportError:
-        return "❌ 错误: 请安装 langchain-community 包: pip install langchain-community"
     except Exception as e:
         return f"❌ 搜索失败: {str(e)}\n💡 请确保已设置正确的 SERPAPI_API_KEY"
 
-# 为了兼容 LangChain 工具格式，添加必要属性
-serpapi_search.name = "serpapi_search"
-serpapi_search.description = "使用 SerpAPI 搜索互联网信息"
-serpapi_search.args_schema = SearchInput
+async def _aserpapi_search(query: str, num_results: int = 5) -> str:
+    """serpapi_search 的异步版本，网络等待期间不占用线程，便于多个工具调用并发执行"""
+    try:
+        search, error = _get_search(num_results)
+        if error:
+            return error
+        
+        # 执行异步搜索
+        result = await search.arun(query)
+        
+        return f"🔍 搜索关键词: {query}\n\n📊 搜索结果:\n{result}"
+            
+    except Exception as e:
+        return f"❌ 搜索失败: {str(e)}\n💡 请确保已设置正确的 SERPAPI_API_KEY"
+
+# 同时提供同步和异步实现，ToolNode 在异步模式下会用 asyncio.gather 并发执行同一步的多个工具调用
+serpapi_search = StructuredTool.from_function(
+    func=_serpapi_search,
+    coroutine=_aserpapi_search,
+    name="serpapi_search",
+    description="使用 SerpAPI 搜索互联网信息",
+    args_schema=SearchInput
+)
 
 
 # ================================
@@ -70,13 +69,13 @@ serpapi_search.args_schema = SearchInput
 
 def get_available_tools():
     """获取可用的工具列表"""
-    if os.getenv("SERPAPI_API_KEY"):
-        try:
-            from langchain_community.utilities import SerpAPIWrapper
-            return [serpapi_search]
-        except ImportError:
-            pass
-    return []
+    return [serpapi_search] if _HAS_SERPAPI and os.getenv("SERPAPI_API_KEY") else []
+
+# 自定义工具 + LangChain 内置工具，导入时根据环境变量计算一次，所有智能体共享
+# （先加载 .env，确保 SERPAPI_API_KEY 在计算前已就绪）
+# 按名称排序，保证发送给模型的工具定义顺序固定，便于命中前缀缓存
+load_dotenv()
+ALL_TOOLS = sorted(AVAILABLE_TOOLS + get_available_tools(), key=lambda t: t.name)
 
 
 if __name__ == "__main__":
@@ -91,7 +90,7 @@ if __name__ == "__main__":
         print(f"✅ {serpapi_search.name}: {serpapi_search.description}")
         
         print("\n🔍 测试搜索:")
-        result = serpapi_search("Python编程", 3)
+        result = serpapi_search.invoke({"query": "Python编程", "num_results": 3})
         print(result[:300] + "..." if len(result) > 300 else result)
     else:
         print("⚠️ SerpAPI 工具不可用")
@@ -3,49 +3,42 @@ LangGraph Studio 入口文件
 为 LangGraph Studio 提供标准化的图形接口
 """
 
-import os
+from functools import cache
 from dotenv import load_dotenv
-from langchain_deepseek import ChatDeepSeek
 from langgraph.prebuilt import create_react_agent
 
 # 导入工具
 from tools import AVAILABLE_TOOLS
-from langchain_tools import get_available_tools
+from langchain_tools import ALL_TOOLS
+from agent import SUMMARY_HOOK, SummaryState, _get_llm, inject_user_context
 
 # 加载环境变量
 load_dotenv()
 
+@cache
 def create_graph():
     """
     创建 LangGraph 图形，供 LangGraph Studio 使用
     注意：LangGraph API 会自动处理持久化，不需要自定义 checkpointer
+    结果会被缓存，多次调用只编译一次
     """
-    # 初始化大模型
-    model = ChatDeepSeek(
-        api_key=os.getenv("DEEPSEEK_API_KEY"),
-        model=os.getenv("MODEL_NAME", "deepseek-chat"),
-        temperature=float(os.getenv("TEMPERATURE", "0.7")),
-        max_tokens=int(os.getenv("MAX_TOKENS", "2000"))
-    )
-    
-    # 组合工具列表
-    all_tools = AVAILABLE_TOOLS.copy()
+    # 获取共享的大模型实例
+    model = _get_llm()
     
-    try:
-        langchain_tools = get_available_tools()
-        all_tools.extend(langchain_tools)
-        print(f"✅ 已加载 {len(langchain_tools)} 个 LangChain 内置工具")
-    except Exception as e:
-        print(f"⚠️ LangChain 工具加载失败: {e}")
+    print(f"✅ 已加载 {len(ALL_TOOLS) - len(AVAILABLE_TOOLS)} 个 LangChain 内置工具")
     
     # 创建 ReAct 智能体图形（不使用自定义 checkpointer）
     graph = create_react_agent(
         model=model,
-        tools=all_tools
+        tools=ALL_TOOLS,
+        prompt=inject_user_context,
+        pre_model_hook=SUMMARY_HOOK,
+        state_schema=SummaryState
         # 注意：移除了 checkpointer 参数，LangGraph API 会自动处理持久化
     )
     
     return graph
 
 # LangGraph Studio 会自动查找这个变量
-graph = create_graph()
\ No newline at end of file
+# 导出图工厂而不是编译好的图：导入本模块时不会编译，LangGraph API 首次需要时才调用
+graph = create_graph
\ No newline at end of file
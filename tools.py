@@ -5,20 +5,117 @@ LangGraph 工具集合 - 结构化工具函数
 确保大模型能够准确识别参数类型和含义。
 """
 
-import json
+import ast
+import asyncio
+import hashlib
+import inspect
 import math
-import random
-import requests
+import os
+import threading
+import time
+import uuid
+import httpx
+import numpy as np
+import orjson
 from datetime import datetime, timedelta
-from typing import Dict, Any, List, Optional
+from functools import lru_cache, wraps
+from types import MappingProxyType
+from typing import Dict, Any, List, Optional, Tuple
 from langchain_core.tools import tool
 from pydantic import BaseModel, Field
 
 
+# 模块级随机数生成器
+_RNG = np.random.default_rng()
+
+# 共享的 HTTP 客户端：复用 TCP/TLS 连接，HTTP/2 下并发请求可多路复用同一连接
+_HTTP_LIMITS = httpx.Limits(max_keepalive_connections=32)
+HTTP_CLIENT = httpx.Client(http2=True, timeout=10, limits=_HTTP_LIMITS)
+
+class LoopLocalTransport(httpx.AsyncBaseTransport):
+    """
+    按事件循环分别维护连接池的异步传输层
+    
+    httpx 的异步连接绑定在首次使用它的事件循环上，循环关闭后再复用会报
+    "Event loop is closed"。这里为每个运行中的事件循环单独创建一个连接池，
+    已关闭循环的连接池会在下次创建时清理，因此共享的 AsyncClient 可以跨多次 asyncio.run 使用。
+    """
+    
+    def __init__(self, **kwargs):
+        self._kwargs = kwargs
+        self._transports: Dict[asyncio.AbstractEventLoop, httpx.AsyncHTTPTransport] = {}
+    
+    def _get_transport(self) -> httpx.AsyncHTTPTransport:
+        loop = asyncio.get_running_loop()
+        transport = self._transports.get(loop)
+        if transport is None:
+            # 连接池持有对所属循环的引用，弱引用无法回收，这里显式丢弃已关闭循环的连接池
+            for closed in [old for old in self._transports if old.is_closed()]:
+                del self._transports[closed]
+            transport = self._transports[loop] = httpx.AsyncHTTPTransport(**self._kwargs)
+        return transport
+    
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await self._get_transport().handle_async_request(request)
+    
+    async def aclose(self) -> None:
+        transport = self._transports.pop(asyncio.get_running_loop(), None)
+        if transport is not None:
+            await transport.aclose()
+
+# 异步版本，供 ainvoke/astream 路径下的工具使用（连接池按事件循环隔离）
+HTTP_ASYNC_CLIENT = httpx.AsyncClient(
+    timeout=10,
+    transport=LoopLocalTransport(http2=True, limits=_HTTP_LIMITS)
+)
+
+# 工具结果缓存：(工具名, 参数哈希) -> (过期时间, 结果)
+_CACHE: Dict[Tuple[str, str], Tuple[float, str]] = {}
+_CACHE_MAXSIZE = 1024
+_CACHE_LOCK = threading.Lock()
+
+def _memoize(ttl: Optional[float] = None):
+    """
+    缓存工具结果的装饰器，相同参数的重复调用直接返回缓存结果
+    
+    Args:
+        ttl: 缓存有效期（秒），None 表示永不过期
+    """
+    def decorator(fn):
+        signature = inspect.signature(fn)
+        
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            args_json = orjson.dumps(bound.arguments, option=orjson.OPT_SORT_KEYS, default=str)
+            key = (fn.__name__, hashlib.blake2b(args_json, digest_size=16).hexdigest())
+            
+            now = time.monotonic()
+            with _CACHE_LOCK:
+                cached = _CACHE.get(key)
+            if cached is not None and cached[0] > now:
+                return cached[1]
+            
+            result = fn(*args, **kwargs)
+            
+            with _CACHE_LOCK:
+                # 超出容量时淘汰最早写入的条目
+                if len(_CACHE) >= _CACHE_MAXSIZE:
+                    _CACHE.pop(next(iter(_CACHE)))
+                _CACHE[key] = (math.inf if ttl is None else now + ttl, result)
+            return result
+        
+        return wrapper
+    return decorator
+
+
 # ================================
 # 1. 天气查询工具
 # ================================
 
+_WEATHER_CONDITIONS = np.array(["晴天", "多云", "阴天", "小雨", "中雨", "大雨", "雪"])
+
 class WeatherInput(BaseModel):
     """天气查询输入参数"""
     city: str = Field(
@@ -32,6 +129,7 @@ class WeatherInput(BaseModel):
     )
 
 @tool("weather_query", args_schema=WeatherInput)
+@_memoize(ttl=600)
 def get_weather(city: str, days: int = 1) -> str:
     """
     查询指定城市的天气信息
@@ -43,27 +141,30 @@ def get_weather(city: str, days: int = 1) -> str:
     Returns:
         天气信息的JSON字符串
     """
-    # 模拟天气数据（实际使用时可以接入真实的天气API）
-    weather_conditions = ["晴天", "多云", "阴天", "小雨", "中雨", "大雨", "雪"]
-    temperatures = list(range(-10, 35))
+    # 模拟天气数据（实际使用时可以接入真实的天气API，请通过 HTTP_CLIENT 发送请求以复用连接）
+    now = datetime.now()
+    conditions = _RNG.choice(_WEATHER_CONDITIONS, days)
+    temperatures = _RNG.integers(-10, 35, days)
+    humidities = _RNG.integers(30, 91, days)
+    winds = _RNG.integers(1, 9, days)
     
     weather_data = {
         "city": city,
-        "query_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "forecast": []
+        "query_time": now.strftime("%Y-%m-%d %H:%M:%S"),
+        "forecast": [
+            {
+                "date": (now + timedelta(days=i)).strftime("%Y-%m-%d"),
+                "condition": str(condition),
+                "temperature": f"{temperature}°C",
+                "humidity": f"{humidity}%",
+                "wind": f"{wind}级"
+            }
+            for i, (condition, temperature, humidity, wind)
+            in enumerate(zip(conditions, temperatures, humidities, winds))
+        ]
     }
     
-    for i in range(days):
-        date = (datetime.now() + timedelta(days=i)).strftime("%Y-%m-%d")
-        weather_data["forecast"].append({
-            "date": date,
-            "condition": random.choice(weather_conditions),
-            "temperature": f"{random.choice(temperatures)}°C",
-            "humidity": f"{random.randint(30, 90)}%",
-            "wind": f"{random.randint(1, 8)}级"
-        })
-    
-    return json.dumps(weather_data, ensure_ascii=False, indent=2)
+    return orjson.dumps(weather_data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode()
 
 
 # ================================
@@ -76,7 +177,55 @@ class CalculatorInput(BaseModel):
         description="要计算的数学表达式，支持基本运算符 +, -, *, /, **, (), 以及数学函数如 sin, cos, tan, log, sqrt 等"
     )
 
+# 安全的数学函数映射（只读，所有调用共享）
+_SAFE_DICT = MappingProxyType({
+    "abs": abs,
+    "round": round,
+    "min": min,
+    "max": max,
+    "sum": sum,
+    "pow": pow,
+    "sqrt": math.sqrt,
+    "sin": math.sin,
+    "cos": math.cos,
+    "tan": math.tan,
+    "log": math.log,
+    "log10": math.log10,
+    "exp": math.exp,
+    "pi": math.pi,
+    "e": math.e,
+})
+
+# 允许出现在表达式中的语法节点
+_ALLOWED_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Call, ast.Name, ast.Load,
+    ast.Constant, ast.Tuple, ast.List, ast.keyword,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow,
+    ast.UAdd, ast.USub,
+)
+
+def _validate(tree: ast.AST) -> None:
+    """校验表达式语法树，只允许数字、白名单函数/常量和基本运算"""
+    for node in ast.walk(tree):
+        if not isinstance(node, _ALLOWED_NODES):
+            raise ValueError(f"不支持的语法: {type(node).__name__}")
+        if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float, complex)):
+            raise ValueError(f"不支持的常量: {node.value!r}")
+        if isinstance(node, ast.Name) and node.id not in _SAFE_DICT:
+            raise ValueError(f"未知的名称: {node.id}")
+        if isinstance(node, ast.Call) and not isinstance(node.func, ast.Name):
+            raise ValueError("只允许调用内置数学函数")
+
+@lru_cache(maxsize=256)
+def _compile(expression: str):
+    """解析、校验并编译表达式，结果按表达式缓存"""
+    # 支持 ^ 作为幂运算（在解析前替换，保持与 ** 相同的优先级）
+    tree = ast.parse(expression.strip().replace("^", "**"), mode="eval")
+    _validate(tree)
+    return compile(tree, "<calc>", "eval")
+
 @tool("calculator", args_schema=CalculatorInput)
+@_memoize()
 def calculate(expression: str) -> str:
     """
     执行数学计算
@@ -88,30 +237,7 @@ def calculate(expression: str) -> str:
         计算结果
     """
     try:
-        # 安全的数学函数映射
-        safe_dict = {
-            "__builtins__": {},
-            "abs": abs,
-            "round": round,
-            "min": min,
-            "max": max,
-            "sum": sum,
-            "pow": pow,
-            "sqrt": math.sqrt,
-            "sin": math.sin,
-            "cos": math.cos,
-            "tan": math.tan,
-            "log": math.log,
-            "log10": math.log10,
-            "exp": math.exp,
-            "pi": math.pi,
-            "e": math.e,
-        }
-        
-        # 替换常用数学函数
-        expression = expression.replace("^", "**")  # 支持 ^ 作为幂运算
-        
-        result = eval(expression, safe_dict)
+        result = eval(_compile(expression), {"__builtins__": {}}, _SAFE_DICT)
         return f"计算结果: {expression} = {result}"
     
     except Exception as e:
@@ -189,6 +315,19 @@ class TextProcessInput(BaseModel):
         description="分割符，用于split操作"
     )
 
+def _count_text(text: str, separator: str) -> str:
+    """统计字符数、单词数和行数"""
+    return f"文本统计:\n字符数: {len(text)}\n单词数: {len(text.split())}\n行数: {len(text.splitlines())}"
+
+# 操作类型 -> 处理函数（统一接收 text 和 separator）
+_TEXT_OPERATIONS = {
+    "count": _count_text,
+    "upper": lambda text, separator: f"转大写: {text.upper()}",
+    "lower": lambda text, separator: f"转小写: {text.lower()}",
+    "reverse": lambda text, separator: f"反转文本: {text[::-1]}",
+    "split": lambda text, separator: f"分割结果: {text.split(separator)}",
+}
+
 @tool("text_processor", args_schema=TextProcessInput)
 def process_text(text: str, operation: str, separator: str = " ") -> str:
     """
@@ -202,24 +341,10 @@ def process_text(text: str, operation: str, separator: str = " ") -> str:
     Returns:
         处理结果
     """
-    if operation == "count":
-        return f"文本统计:\n字符数: {len(text)}\n单词数: {len(text.split())}\n行数: {len(text.splitlines())}"
-    
-    elif operation == "upper":
-        return f"转大写: {text.upper()}"
-    
-    elif operation == "lower":
-        return f"转小写: {text.lower()}"
-    
-    elif operation == "reverse":
-        return f"反转文本: {text[::-1]}"
-    
-    elif operation == "split":
-        parts = text.split(separator)
-        return f"分割结果: {parts}"
-    
-    else:
+    handler = _TEXT_OPERATIONS.get(operation)
+    if handler is None:
         return "不支持的操作类型"
+    return handler(text, separator)
 
 
 # ================================
@@ -250,22 +375,21 @@ def generate_random(type: str, min_value: int = 1, max_value: int = 100, choices
         随机结果
     """
     if type == "int":
-        result = random.randint(min_value, max_value)
+        result = int(_RNG.integers(min_value, max_value + 1))
         return f"随机整数: {result}"
     
     elif type == "float":
-        result = random.uniform(min_value, max_value)
+        result = float(_RNG.uniform(min_value, max_value))
         return f"随机浮点数: {result:.2f}"
     
     elif type == "choice":
         if choices and len(choices) > 0:
-            result = random.choice(choices)
+            result = str(_RNG.choice(choices))
             return f"随机选择: {result}"
         else:
             return "请提供选择列表"
     
     elif type == "uuid":
-        import uuid
         result = str(uuid.uuid4())
         return f"UUID: {result}"
     
@@ -286,7 +410,59 @@ class ConversionInput(BaseModel):
         description="转换类别：'length'(长度), 'weight'(重量), 'temperature'(温度), 'area'(面积)"
     )
 
+# 长度转换（以米为基准）
+_LENGTH_UNITS = {
+    "mm": 0.001, "cm": 0.01, "m": 1, "km": 1000,
+    "inch": 0.0254, "ft": 0.3048, "yard": 0.9144, "mile": 1609.34
+}
+
+# 重量转换（以克为基准）
+_WEIGHT_UNITS = {
+    "mg": 0.001, "g": 1, "kg": 1000, "ton": 1000000,
+    "oz": 28.3495, "lb": 453.592
+}
+
+# 面积转换（以平方米为基准）
+_AREA_UNITS = {
+    "cm2": 0.0001, "m2": 1, "km2": 1000000,
+    "acre": 4046.86, "hectare": 10000
+}
+
+# 温度转换：(源单位, 目标单位) -> (换算函数, 源单位符号, 目标单位符号)
+_TEMPERATURE_CONVERSIONS = {
+    ("C", "F"): (lambda v: (v * 9/5) + 32, "°C", "°F"),
+    ("F", "C"): (lambda v: (v - 32) * 5/9, "°F", "°C"),
+    ("C", "K"): (lambda v: v + 273.15, "°C", "K"),
+    ("K", "C"): (lambda v: v - 273.15, "K", "°C"),
+}
+
+def _ratio_converter(units: Dict[str, float]):
+    """按基准单位比例换算的转换函数，不支持的单位返回 None"""
+    def convert(value: float, from_unit: str, to_unit: str) -> Optional[str]:
+        if from_unit in units and to_unit in units:
+            result = value * units[from_unit] / units[to_unit]
+            return f"转换结果: {value} {from_unit} = {result:.4f} {to_unit}"
+        return None
+    return convert
+
+def _convert_temperature(value: float, from_unit: str, to_unit: str) -> Optional[str]:
+    """温度换算，不支持的单位组合返回 None"""
+    conversion = _TEMPERATURE_CONVERSIONS.get((from_unit, to_unit))
+    if conversion is None:
+        return None
+    fn, from_symbol, to_symbol = conversion
+    return f"转换结果: {value}{from_symbol} = {fn(value):.2f}{to_symbol}"
+
+# 转换类别 -> 转换函数
+_CONVERTERS = {
+    "length": _ratio_converter(_LENGTH_UNITS),
+    "weight": _ratio_converter(_WEIGHT_UNITS),
+    "area": _ratio_converter(_AREA_UNITS),
+    "temperature": _convert_temperature,
+}
+
 @tool("unit_converter", args_schema=ConversionInput)
+@_memoize()
 def convert_units(value: float, from_unit: str, to_unit: str, category: str) -> str:
     """
     单位转换
@@ -300,56 +476,11 @@ def convert_units(value: float, from_unit: str, to_unit: str, category: str) ->
     Returns:
         转换结果
     """
-    # 长度转换（以米为基准）
-    length_units = {
-        "mm": 0.001, "cm": 0.01, "m": 1, "km": 1000,
-        "inch": 0.0254, "ft": 0.3048, "yard": 0.9144, "mile": 1609.34
-    }
-    
-    # 重量转换（以克为基准）
-    weight_units = {
-        "mg": 0.001, "g": 1, "kg": 1000, "ton": 1000000,
-        "oz": 28.3495, "lb": 453.592
-    }
-    
-    # 面积转换（以平方米为基准）
-    area_units = {
-        "cm2": 0.0001, "m2": 1, "km2": 1000000,
-        "acre": 4046.86, "hectare": 10000
-    }
-    
     try:
-        if category == "length":
-            if from_unit in length_units and to_unit in length_units:
-                meters = value * length_units[from_unit]
-                result = meters / length_units[to_unit]
-                return f"转换结果: {value} {from_unit} = {result:.4f} {to_unit}"
-        
-        elif category == "weight":
-            if from_unit in weight_units and to_unit in weight_units:
-                grams = value * weight_units[from_unit]
-                result = grams / weight_units[to_unit]
-                return f"转换结果: {value} {from_unit} = {result:.4f} {to_unit}"
-        
-        elif category == "area":
-            if from_unit in area_units and to_unit in area_units:
-                square_meters = value * area_units[from_unit]
-                result = square_meters / area_units[to_unit]
-                return f"转换结果: {value} {from_unit} = {result:.4f} {to_unit}"
-        
-        elif category == "temperature":
-            if from_unit == "C" and to_unit == "F":
-                result = (value * 9/5) + 32
-                return f"转换结果: {value}°C = {result:.2f}°F"
-            elif from_unit == "F" and to_unit == "C":
-                result = (value - 32) * 5/9
-                return f"转换结果: {value}°F = {result:.2f}°C"
-            elif from_unit == "C" and to_unit == "K":
-                result = value + 273.15
-                return f"转换结果: {value}°C = {result:.2f}K"
-            elif from_unit == "K" and to_unit == "C":
-                result = value - 273.15
-                return f"转换结果: {value}K = {result:.2f}°C"
+        converter = _CONVERTERS.get(category)
+        result = converter(value, from_unit, to_unit) if converter else None
+        if result is not None:
+            return result
         
         return f"不支持的转换: {from_unit} -> {to_unit} ({category})"
     
@@ -361,6 +492,66 @@ def convert_units(value: float, from_unit: str, to_unit: str, category: str) ->
 # 7. 网络搜索工具 (SerpAPI)
 # ================================
 
+SERPAPI_URL = "https://serpapi.com/search"
+
+try:
+    from langchain_community.utilities import SerpAPIWrapper
+    _HAS_SERPAPI = True
+except ImportError:
+    _HAS_SERPAPI = False
+
+if _HAS_SERPAPI:
+    class PooledSerpAPIWrapper(SerpAPIWrapper):
+        """通过共享的 HTTP_CLIENT / HTTP_ASYNC_CLIENT 发送请求的 SerpAPIWrapper，避免每次搜索都重新建立连接"""
+        
+        def results(self, query: str) -> dict:
+            response = HTTP_CLIENT.get(SERPAPI_URL, params=self._request_params(query))
+            return response.json()
+        
+        async def aresults(self, query: str) -> dict:
+            response = await HTTP_ASYNC_CLIENT.get(SERPAPI_URL, params=self._request_params(query))
+            return response.json()
+        
+        def _request_params(self, query: str) -> dict:
+            params = self.get_params(query)
+            params["source"] = "python"
+            params["output"] = "json"
+            return params
+
+# 按 (api_key, num_results) 缓存的搜索包装器，避免每次搜索都重新创建
+_SEARCH_WRAPPERS = {}
+
+def _get_search_wrapper(api_key: str, num_results: int):
+    """获取（或创建）缓存的 SerpAPIWrapper 实例"""
+    key = (api_key, num_results)
+    search = _SEARCH_WRAPPERS.get(key)
+    if search is None:
+        search = PooledSerpAPIWrapper(
+            serpapi_api_key=api_key,
+            params={
+                "engine": "google",
+                "google_domain": "google.com.hk",
+                "gl": "cn",
+                "hl": "zh-cn",
+                "num": num_results
+            }
+        )
+        _SEARCH_WRAPPERS[key] = search
+    return search
+
+def _get_search(num_results: int):
+    """检查依赖和API密钥，返回 (搜索包装器, 错误信息)"""
+    if not _HAS_SERPAPI:
+        return None, "❌ 错误: 请安装 langchain-community 包: pip install langchain-community"
+    
+    # 检查API密钥
+    api_key = os.getenv("SERPAPI_API_KEY")
+    if not api_key:
+        return None, "❌ 错误: 请设置 SERPAPI_API_KEY 环境变量"
+    
+    # 复用缓存的搜索包装器
+    return _get_search_wrapper(api_key, num_results), None
+
 class SearchInput(BaseModel):
     """搜索输入参数"""
     query: str = Field(description="搜索关键词或问题")
@@ -379,11 +570,9 @@ def search_web(query: str, num_results: int = 5) -> str:
         搜索结果摘要
     """
     try:
-        # 导入 SerpAPI
-        from langchain_community.utilities import SerpAPIWrapper
-        
-        # 初始化 SerpAPI
-        search = SerpAPIWrapper()
+        search, error = _get_search(num_results)
+        if error:
+            return error
         
         # 执行搜索
         results = search.run(query)
@@ -394,8 +583,6 @@ def search_web(query: str, num_results: int = 5) -> str:
         else:
             return f"未找到关于 '{query}' 的相关信息"
             
-    except ImportError:
-        return "❌ 错误: 请安装 langchain-community 包: pip install langchain-community"
     except Exception as e:
         return f"❌ 搜索失败: {str(e)}\n💡 请确保已设置 SERPAPI_API_KEY 环境变量"
 